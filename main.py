@@ -1,29 +1,45 @@
 """
 EduClip AI - FastAPI Backend Implementation - FIXED FOR RENDER
 Complete backend API with proper CORS, error handling, and logging
+
+Rule: no blocking syscalls in async def handlers. File I/O goes through aiofiles,
+CPU-bound work (bcrypt, pipeline stages) through an executor.
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional, Dict
+from fastapi.responses import ORJSONResponse, FileResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, ConfigDict, EmailStr, StringConstraints
+from typing import Annotated, List, Optional, Dict
 import os
-import uuid
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import jwt
 import bcrypt
 from pathlib import Path
-import json
 import asyncio
+import base64
+import hashlib
+import hmac
+import mimetypes
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import time
 from enum import Enum
+from urllib.parse import quote
+from cachetools import TTLCache
+import aiofiles
+import aiofiles.os
+import orjson
 
 # Configure logging with more detail
+# Render stamps every line at the log sink, so skip formatting asctime there
+LOG_FORMAT = '%(name)s - %(levelname)s - %(message)s'
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format=LOG_FORMAT if os.getenv("RENDER") else '%(asctime)s - ' + LOG_FORMAT
 )
 logger = logging.getLogger(__name__)
 
@@ -33,38 +49,215 @@ app = FastAPI(
     description="AI-Enhanced Video Editing and Summarization for Educational Content",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
 )
 
-# ✅ FIXED: Proper CORS configuration for Render
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "2048")) << 20
+
+class UploadSizeLimitMiddleware:
+    """Reject oversized uploads before the body is buffered: from Content-Length when
+    present, otherwise as soon as the streamed body passes the limit"""
+    
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/api/videos/upload":
+            content_length = dict(scope["headers"]).get(b"content-length", b"0")
+            if content_length.isdigit() and int(content_length) > self.max_bytes:
+                logger.warning("HTTP 413: Upload of %s bytes rejected", int(content_length))
+                response = ORJSONResponse(
+                    status_code=413,
+                    content={
+                        "success": False,
+                        "message": "File too large",
+                        "status_code": 413
+                    }
+                )
+                await response(scope, receive, send)
+                return
+            
+            # Chunked uploads carry no Content-Length, so count body bytes as they arrive;
+            # FastAPI re-raises HTTPExceptions from body parsing, giving the usual JSON 413
+            received = 0
+            
+            async def limited_receive():
+                nonlocal received
+                message = await receive()
+                if message["type"] == "http.request":
+                    received += len(message.get("body", b""))
+                    if received > self.max_bytes:
+                        raise HTTPException(status_code=413, detail="File too large")
+                return message
+            
+            await self.app(scope, limited_receive, send)
+            return
+        await self.app(scope, receive, send)
+
+# Only routes under these prefixes depend on current_user; public ones such as /health
+# never pay for, or log, a token check
+PROTECTED_PREFIXES = ("/api/videos", "/api/analytics", "/api/auth/refresh")
+
+class AuthMiddleware:
+    """Verify the bearer token once per request and record the result on request.state"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(PROTECTED_PREFIXES):
+            authorization = dict(scope["headers"]).get(b"authorization", b"").decode("latin-1")
+            scheme, _, token = authorization.partition(" ")
+            if token and scheme.lower() == "bearer":
+                state = scope.setdefault("state", {})
+                try:
+                    state["user_id"] = decode_token(token)
+                except HTTPException as e:
+                    state["auth_error"] = e
+        await self.app(scope, receive, send)
+
+class ErrorResponseMiddleware:
+    """Turn unhandled exceptions into the JSON 500 body, logging each one once"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        response_started = False
+        
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, tracking_send)
+        except Exception as exc:
+            # Too late for a clean 500; let the server log it and drop the connection
+            if response_started:
+                raise
+            logger.error("❌ Unhandled error: %s", exc, exc_info=True)
+            response = ORJSONResponse(
+                status_code=500,
+                content={
+                    "success": False,
+                    "message": "Internal server error"
+                }
+            )
+            await response(scope, receive, send)
+
+# Registered before CORS so rejections and 500s still carry CORS headers; an
+# @app.exception_handler(Exception) would run in ServerErrorMiddleware, outside CORS,
+# and Starlette re-raises from there so the traceback would be logged twice
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
+app.add_middleware(AuthMiddleware)
+app.add_middleware(ErrorResponseMiddleware)
+
+# CORS: comma-separated ALLOWED_ORIGINS and/or an ALLOWED_ORIGIN_REGEX (e.g. preview
+# deployments), or any origin when neither is set. Auth travels in the Authorization
+# header rather than cookies, so credentials are only needed for explicit origins
+ALLOWED_ORIGIN_REGEX = os.getenv("ALLOWED_ORIGIN_REGEX") or None
+ALLOWED_ORIGINS = [o.strip() for o in os.getenv("ALLOWED_ORIGINS", "").split(",") if o.strip()]
+if not ALLOWED_ORIGINS and not ALLOWED_ORIGIN_REGEX:
+    ALLOWED_ORIGINS = ["*"]
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # Allow all origins for development
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["*"]
+    allow_origins=ALLOWED_ORIGINS,
+    allow_origin_regex=ALLOWED_ORIGIN_REGEX,
+    allow_credentials=ALLOWED_ORIGINS != ["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Authorization", "Content-Type"],
+    expose_headers=["ETag"]
 )
 
 # Security
-security = HTTPBearer(auto_error=False)
-SECRET_KEY = os.getenv("SECRET_KEY", "educlip-secret-key-" + str(uuid.uuid4()))
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
+# With JWT_PRIVATE_KEY and/or JWT_PUBLIC_KEY (Ed25519 PEM) tokens use EdDSA: the private
+# key signs, and an instance given only the public key verifies but never issues tokens.
+# Without either, tokens are HS256 under SECRET_KEY
+SECRET_KEY = os.getenv("SECRET_KEY") or os.urandom(32).hex()
+JWT_PRIVATE_KEY = os.getenv("JWT_PRIVATE_KEY", "").replace("\\n", "\n")
+JWT_PUBLIC_KEY = os.getenv("JWT_PUBLIC_KEY", "").replace("\\n", "\n")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", str(60 * 24)))  # 24 hours
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "10"))
+# Dedicated bcrypt threads, one per core: bcrypt releases the GIL, so a register burst
+# hashes in parallel without a process pool, and never queues behind the default executor.
+# Created per app lifespan in start_hash_pool()
+hash_pool: ThreadPoolExecutor = None
+# Salts are built directly: the cost prefix never changes, only the 16 random bytes do
+_BCRYPT_PREFIX = b"$2b$%02d$" % BCRYPT_ROUNDS
+_BCRYPT_B64 = bytes.maketrans(
+    b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/",
+    b"./ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789",
+)
+_SECRET_BYTES = SECRET_KEY.encode()
+if JWT_PRIVATE_KEY or JWT_PUBLIC_KEY:
+    ALGORITHM = "EdDSA"
+    # Parse the PEMs once; PyJWT would otherwise reload them on every encode/decode
+    _eddsa = jwt.get_algorithm_by_name(ALGORITHM)  # requires PyJWT[crypto]
+    _SIGNING_KEY = _eddsa.prepare_key(JWT_PRIVATE_KEY) if JWT_PRIVATE_KEY else None
+    _VERIFY_KEY = _eddsa.prepare_key(JWT_PUBLIC_KEY) if JWT_PUBLIC_KEY else _SIGNING_KEY.public_key()
+else:
+    ALGORITHM = "HS256"
+    _SIGNING_KEY = _VERIFY_KEY = _SECRET_BYTES
+_TOKEN_TTL = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+_DECODE_OPTIONS = {"verify_exp": True}
+
+# Verified tokens, keyed by a 16-byte BLAKE2b digest so raw bearer strings never sit in memory
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "30"))  # seconds; bounds how long a revoked token keeps working
+_token_cache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL)
+_token_cache_lock = threading.Lock()
+
+# Successful password checks, keyed by HMAC(SECRET_KEY, password + hash) so plaintext is never stored
+VERIFY_PASSWORD_CACHE = os.getenv("VERIFY_PASSWORD_CACHE", "true").lower() == "true"
+_pw_cache = TTLCache(maxsize=2048, ttl=300)
+
+# Per-user analytics aggregates, so polling dashboards don't recompute on every refresh
+_analytics_cache = TTLCache(maxsize=1024, ttl=15)
 
 # ✅ FIXED: Use /tmp for Render (ephemeral storage)
 BASE_DIR = Path("/tmp") if os.getenv("RENDER") else Path("./storage")
 UPLOAD_DIR = BASE_DIR / "uploads"
 CLIPS_DIR = BASE_DIR / "clips"
 THUMBNAILS_DIR = BASE_DIR / "thumbnails"
+TRANSCRIPTS_DIR = BASE_DIR / "transcripts"
+SUMMARIES_DIR = BASE_DIR / "summaries"
+CLIP_PLANS_DIR = BASE_DIR / "clip_plans"  # clip-stage JSON; CLIPS_DIR holds the media
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+ALLOWED_VIDEO_TYPES = frozenset({
+    "video/mp4",
+    "video/webm",
+    "video/quicktime",
+    "video/x-matroska",
+    "video/mpeg",
+    "video/x-msvideo",
+})
+
+# Internal nginx location mapped to BASE_DIR (e.g. "/_protected"); when set, downloads
+# are handed to nginx via X-Accel-Redirect instead of being streamed through Python
+ACCEL_REDIRECT_PREFIX = os.getenv("ACCEL_REDIRECT_PREFIX", "").rstrip("/")
+
+# Video processing is a transcribe -> analyze -> clips pipeline; each stage gets
+# PROCESSING_WORKERS consumers and one pool thread per consumer, so stages overlap
+# across videos and a slow stage never starves the others
+PROCESSING_WORKERS = int(os.getenv("PROCESSING_WORKERS", "2"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "100"))
+# Bump to invalidate every cached stage artifact after changing models or parameters
+PIPELINE_VERSION = "1"
 
 # Create directories
-for directory in [UPLOAD_DIR, CLIPS_DIR, THUMBNAILS_DIR]:
+for directory in [UPLOAD_DIR, CLIPS_DIR, THUMBNAILS_DIR, TRANSCRIPTS_DIR, SUMMARIES_DIR, CLIP_PLANS_DIR]:
     try:
         directory.mkdir(parents=True, exist_ok=True)
-        logger.info(f"✓ Directory created: {directory}")
+        logger.info("✓ Directory created: %s", directory)
     except Exception as e:
-        logger.warning(f"Directory creation warning: {e}")
+        logger.warning("Directory creation warning: %s", e)
 
 # ============= Models =============
 
@@ -82,63 +275,184 @@ class VideoStatus(str, Enum):
     COMPLETE = "complete"
     FAILED = "failed"
 
+# Plain-string values for the hot paths, which store and compare str rather than enum members
+ROLE_ADMIN = UserRole.ADMIN.value
+STATUS_PROCESSING = VideoStatus.PROCESSING.value
+STATUS_COMPLETE = VideoStatus.COMPLETE.value
+STATUS_FAILED = VideoStatus.FAILED.value
+
 class UserRegister(BaseModel):
-    username: str
+    model_config = ConfigDict(extra='forbid', frozen=True)
+    
+    # Passwords are deliberately not stripped; whitespace in them is significant
+    username: Annotated[str, StringConstraints(strip_whitespace=True)]
     email: EmailStr
     password: str
     role: UserRole = UserRole.STUDENT
 
 class UserLogin(BaseModel):
+    model_config = ConfigDict(extra='forbid', frozen=True)
+
     email: EmailStr
     password: str
 
 class VideoMetadata(BaseModel):
+    model_config = ConfigDict(extra='forbid', frozen=True, str_strip_whitespace=True)
+
     title: str
     description: Optional[str] = None
     tags: Optional[List[str]] = []
 
 # ============= In-Memory Database =============
+# Process-local state: run a single worker process until this moves to a shared store
 users_db = {}
+users_by_email: Dict[str, str] = {}  # lowercased email -> user_id
+users_by_username: Dict[str, str] = {}  # username -> user_id
 videos_db = {}
+videos_by_user: Dict[str, List[str]] = defaultdict(list)  # user_id -> video_ids, upload order
+content_index: Dict[tuple, str] = {}  # (user_id, SHA-256 of the file) -> video_id
 transcripts_db = {}
 summaries_db = {}
 clips_db = {}
+clips_by_video: Dict[str, List[str]] = defaultdict(list)  # video_id -> clip_ids
+etags_db: Dict[tuple, str] = {}  # (resource, video_id) -> ETag of the immutable result
 analytics_db = {}
 
+# Pipeline queues, worker tasks and thread pool, created per app lifespan in start_pipeline()
+transcribe_q: asyncio.Queue = None
+analyze_q: asyncio.Queue = None
+clip_q: asyncio.Queue = None
+pipeline_tasks: List[asyncio.Task] = []
+processing_pool: ThreadPoolExecutor = None
+
 # ============= Helper Functions =============
 
+def looks_like_video(header: bytes) -> bool:
+    """Check the leading bytes of a file for a known video container signature"""
+    return (
+        header[4:8] == b"ftyp"                                  # MP4 / MOV / M4V / 3GP
+        or header[4:8] in (b"moov", b"mdat", b"wide", b"free")  # Older QuickTime
+        or header[:4] == b"\x1a\x45\xdf\xa3"                    # Matroska / WebM
+        or header[:4] in (b"\x00\x00\x01\xba", b"\x00\x00\x01\xb3")  # MPEG program stream
+        or (header[:4] == b"RIFF" and header[8:12] == b"AVI ")  # AVI
+    )
+
+def generate_id() -> str:
+    """Random 128-bit identifier as 32 hex chars"""
+    return os.urandom(16).hex()
+
+# bcrypt is CPU-bound but releases the GIL, so both helpers run it on hash_pool
+# and the event loop keeps serving other requests meanwhile
+def new_salt() -> bytes:
+    """bcrypt salt at BCRYPT_ROUNDS; equivalent to bcrypt.gensalt() without re-encoding the cost"""
+    return _BCRYPT_PREFIX + base64.b64encode(os.urandom(16)).translate(_BCRYPT_B64)[:22]
+
+async def hash_password(password: bytes) -> bytes:
+    """Hash a password with a fresh salt at BCRYPT_ROUNDS"""
+    return await asyncio.get_running_loop().run_in_executor(
+        hash_pool, bcrypt.hashpw, password, new_salt()
+    )
+
+async def check_password(password: bytes, password_hash: bytes) -> bool:
+    """Check a password against a stored bcrypt hash"""
+    return await asyncio.get_running_loop().run_in_executor(
+        hash_pool, bcrypt.checkpw, password, password_hash
+    )
+
+def require_token_issuer():
+    """Refuse up front on a verify-only instance (JWT_PUBLIC_KEY without JWT_PRIVATE_KEY)"""
+    if _SIGNING_KEY is None:
+        raise HTTPException(status_code=503, detail="This server cannot issue tokens")
+
 def create_access_token(data: dict):
     """Create JWT access token"""
+    require_token_issuer()
+    
     try:
         to_encode = data.copy()
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        to_encode.update({"exp": expire})
-        encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+        to_encode["exp"] = datetime.now(timezone.utc) + _TOKEN_TTL
+        encoded_jwt = jwt.encode(to_encode, _SIGNING_KEY, algorithm=ALGORITHM)
         return encoded_jwt
     except Exception as e:
-        logger.error(f"Token creation error: {str(e)}")
+        logger.error("Token creation error: %s", e)
         raise HTTPException(status_code=500, detail="Failed to create authentication token")
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Verify JWT token"""
-    if not credentials:
-        raise HTTPException(status_code=401, detail="Authentication required")
+def decode_token(token: str) -> str:
+    """Verify JWT token and return its user id"""
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+    # Cache entries never outlive the token's own expiry
+    if cached and cached[1] > time.time():
+        return cached[0]
     
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, _VERIFY_KEY, algorithms=[ALGORITHM], options=_DECODE_OPTIONS)
         user_id = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-        return user_id
+    except HTTPException:
+        raise
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
-    except jwt.JWTError as e:
-        logger.error(f"JWT verification error: {str(e)}")
+    except jwt.InvalidTokenError as e:
+        logger.error("JWT verification error: %s", e)
         raise HTTPException(status_code=401, detail="Invalid authentication token")
     except Exception as e:
-        logger.error(f"Token verification error: {str(e)}")
+        logger.error("Token verification error: %s", e)
         raise HTTPException(status_code=401, detail="Authentication failed")
+    
+    expires_at = min(time.time() + TOKEN_CACHE_TTL, payload["exp"])
+    with _token_cache_lock:
+        _token_cache[key] = (user_id, expires_at)
+    return user_id
+
+async def current_user(request: Request) -> str:
+    """Authenticated user id, as resolved by AuthMiddleware (async so it skips the threadpool)"""
+    user_id = getattr(request.state, "user_id", None)
+    if user_id is None:
+        auth_error = getattr(request.state, "auth_error", None)
+        raise auth_error or HTTPException(status_code=401, detail="Authentication required")
+    return user_id
+
+def file_download(path: Path, filename: str):
+    """Serve a stored file, delegating the transfer to nginx when configured"""
+    # FileResponse streams straight from disk in chunks; never wrap open().read() in a
+    # StreamingResponse here, which would buffer and copy every byte through Python
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    if ACCEL_REDIRECT_PREFIX:
+        # Same encoding FileResponse uses: the extension comes from the client's filename,
+        # so anything beyond plain characters goes through RFC 5987 filename*
+        quoted = quote(filename)
+        if quoted != filename:
+            disposition = f"attachment; filename*=utf-8''{quoted}"
+        else:
+            disposition = f'attachment; filename="{filename}"'
+        return Response(
+            media_type=media_type,
+            headers={
+                "X-Accel-Redirect": f"{ACCEL_REDIRECT_PREFIX}/{quote(path.relative_to(BASE_DIR).as_posix())}",
+                "Content-Disposition": disposition
+            }
+        )
+    return FileResponse(path, media_type=media_type, filename=filename)
+
+def compute_etag(payload) -> str:
+    """Strong ETag for a JSON-serializable payload"""
+    return '"' + hashlib.sha256(orjson.dumps(payload)).hexdigest()[:16] + '"'
+
+def conditional_response(request: Request, response: Response, etag: Optional[str], data):
+    """Answer 304 when the client already holds this version, else the payload with validators"""
+    if etag is None:
+        return {"success": True, "data": data}
+    
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=3600"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in if_none_match):
+        return Response(status_code=304, headers=headers)
+    
+    response.headers.update(headers)
+    return {"success": True, "data": data}
 
 # ============= Root & Health Endpoints =============
 
@@ -154,144 +468,168 @@ async def root():
         "message": "Welcome to EduClip AI - AI-Enhanced Educational Video Platform"
     }
 
+# The platform polls /health constantly, so its body is serialized at most once a second
+ENVIRONMENT = "render" if os.getenv("RENDER") else "local"
+_health_cache = (0, b"")
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {
-        "status": "healthy",
-        "timestamp": datetime.utcnow().isoformat(),
-        "environment": "render" if os.getenv("RENDER") else "local",
-        "users_count": len(users_db),
-        "videos_count": len(videos_db),
-        "python_version": "3.9+"
-    }
+    global _health_cache
+    now = int(time.time())
+    if now != _health_cache[0]:
+        _health_cache = (now, orjson.dumps({
+            "status": "healthy",
+            "timestamp": datetime.fromtimestamp(now, timezone.utc).isoformat(),
+            "environment": ENVIRONMENT,
+            "users_count": len(users_db),
+            "videos_count": len(videos_db),
+            "python_version": "3.9+"
+        }))
+    return Response(_health_cache[1], media_type="application/json")
 
 # ============= Authentication Endpoints =============
 
 @app.post("/api/auth/register", status_code=status.HTTP_201_CREATED)
 async def register(user: UserRegister):
     """Register new user - FIXED VERSION"""
+    # Refuse before creating an account we couldn't hand a token for
+    require_token_issuer()
+    
+    logger.info("📝 Registration attempt - Email: %s, Username: %s", user.email, user.username)
+    
+    # ✅ FIXED: Better validation
+    if not user.username or len(user.username) < 3:
+        logger.warning("Invalid username length: %s", len(user.username) if user.username else 0)
+        raise HTTPException(status_code=400, detail="Username must be at least 3 characters long")
+    
+    if not user.email:
+        raise HTTPException(status_code=400, detail="Email address is required")
+    
+    if not user.password or len(user.password) < 6:
+        logger.warning("Invalid password length")
+        raise HTTPException(status_code=400, detail="Password must be at least 6 characters long")
+    
+    # Check if email already exists
+    if user.email.lower() in users_by_email:
+        logger.warning("Email already registered: %s", user.email)
+        raise HTTPException(status_code=400, detail="This email is already registered")
+    
+    # Check if username already exists
+    if user.username in users_by_username:
+        logger.warning("Username already taken: %s", user.username)
+        raise HTTPException(status_code=400, detail="This username is already taken")
+    
+    # Claim the email and username before the expensive hash, so a concurrent
+    # duplicate is rejected by the checks above instead of hashing too
+    user_id = generate_id()
+    users_by_email[user.email.lower()] = user_id
+    users_by_username[user.username] = user_id
+    
+    # Hash password
     try:
-        logger.info(f"📝 Registration attempt - Email: {user.email}, Username: {user.username}")
-        
-        # ✅ FIXED: Better validation
-        if not user.username or len(user.username) < 3:
-            logger.warning(f"Invalid username length: {len(user.username) if user.username else 0}")
-            raise HTTPException(status_code=400, detail="Username must be at least 3 characters long")
-        
-        if not user.email:
-            raise HTTPException(status_code=400, detail="Email address is required")
-        
-        if not user.password or len(user.password) < 6:
-            logger.warning("Invalid password length")
-            raise HTTPException(status_code=400, detail="Password must be at least 6 characters long")
-        
-        # Check if email already exists
-        existing_user = next((u for u in users_db.values() if u["email"] == user.email), None)
-        if existing_user:
-            logger.warning(f"Email already registered: {user.email}")
-            raise HTTPException(status_code=400, detail="This email is already registered")
-        
-        # Check if username already exists
-        existing_username = next((u for u in users_db.values() if u["username"] == user.username), None)
-        if existing_username:
-            logger.warning(f"Username already taken: {user.username}")
-            raise HTTPException(status_code=400, detail="This username is already taken")
-        
-        # Hash password
-        password_hash = bcrypt.hashpw(user.password.encode('utf-8'), bcrypt.gensalt())
-        
-        # Create user
-        user_id = str(uuid.uuid4())
-        users_db[user_id] = {
+        password_hash = await hash_password(user.password.encode('utf-8'))
+    except BaseException:
+        del users_by_email[user.email.lower()]
+        del users_by_username[user.username]
+        raise
+    
+    # Create user
+    users_db[user_id] = {
+        "user_id": user_id,
+        "username": user.username,
+        "email": user.email,
+        "password_hash": password_hash,
+        "role": user.role.value,
+        "created_at": datetime.now(timezone.utc),
+        "last_login": None
+    }
+    
+    logger.info("✅ User registered successfully - ID: %s, Email: %s", user_id, user.email)
+    
+    # Generate token
+    token = create_access_token({"sub": user_id})
+    
+    return {
+        "success": True,
+        "message": "Registration successful! Welcome to EduClip AI",
+        "data": {
             "user_id": user_id,
             "username": user.username,
             "email": user.email,
-            "password_hash": password_hash,
-            "role": user.role.value if isinstance(user.role, Enum) else user.role,
-            "created_at": datetime.utcnow().isoformat(),
-            "last_login": None
+            "role": user.role.value,
+            "token": token
         }
-        
-        logger.info(f"✅ User registered successfully - ID: {user_id}, Email: {user.email}")
-        
-        # Generate token
-        token = create_access_token({"sub": user_id})
-        
-        return {
-            "success": True,
-            "message": "Registration successful! Welcome to EduClip AI",
-            "data": {
-                "user_id": user_id,
-                "username": user.username,
-                "email": user.email,
-                "role": user.role.value if isinstance(user.role, Enum) else user.role,
-                "token": token
-            }
-        }
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"❌ Registration error: {str(e)}", exc_info=True)
-        raise HTTPException(
-            status_code=500,
-            detail=f"Registration failed: {str(e)}"
-        )
+    }
 
 @app.post("/api/auth/login")
 async def login(credentials: UserLogin):
     """User login - FIXED VERSION"""
-    try:
-        logger.info(f"🔐 Login attempt - Email: {credentials.email}")
-        
-        # Validate input
-        if not credentials.email:
-            raise HTTPException(status_code=400, detail="Email is required")
-        
-        if not credentials.password:
-            raise HTTPException(status_code=400, detail="Password is required")
-        
-        # Find user by email
-        user = next((u for u in users_db.values() if u["email"] == credentials.email), None)
-        
-        if not user:
-            logger.warning(f"❌ User not found: {credentials.email}")
-            raise HTTPException(status_code=401, detail="Invalid email or password")
-        
-        # Verify password
-        if not bcrypt.checkpw(credentials.password.encode('utf-8'), user["password_hash"]):
-            logger.warning(f"❌ Invalid password for: {credentials.email}")
+    # Refuse before running bcrypt for a token we couldn't sign
+    require_token_issuer()
+    
+    logger.info("🔐 Login attempt - Email: %s", credentials.email)
+    
+    # Validate input
+    if not credentials.email:
+        raise HTTPException(status_code=400, detail="Email is required")
+    
+    if not credentials.password:
+        raise HTTPException(status_code=400, detail="Password is required")
+    
+    # Find user by email
+    uid = users_by_email.get(credentials.email.lower())
+    user = users_db.get(uid) if uid else None
+    
+    if not user:
+        logger.warning("❌ User not found: %s", credentials.email)
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    
+    # Verify password, skipping bcrypt for recently verified credentials
+    password = credentials.password.encode('utf-8')
+    cache_key = hmac.new(_SECRET_BYTES, password + user["password_hash"], "sha256").digest()
+    if not (VERIFY_PASSWORD_CACHE and cache_key in _pw_cache):
+        if not await check_password(password, user["password_hash"]):
+            logger.warning("❌ Invalid password for: %s", credentials.email)
             raise HTTPException(status_code=401, detail="Invalid email or password")
-        
-        # Update last login
-        user["last_login"] = datetime.utcnow().isoformat()
-        
-        logger.info(f"✅ Login successful - Email: {credentials.email}")
-        
-        # Generate token
-        token = create_access_token({"sub": user["user_id"]})
-        
-        return {
-            "success": True,
-            "message": "Login successful",
-            "data": {
-                "user_id": user["user_id"],
-                "username": user["username"],
-                "email": user["email"],
-                "role": user["role"],
-                "token": token
-            }
+        if VERIFY_PASSWORD_CACHE:
+            _pw_cache[cache_key] = True
+    
+    # Update last login
+    user["last_login"] = datetime.now(timezone.utc)
+    
+    logger.info("✅ Login successful - Email: %s", credentials.email)
+    
+    # Generate token
+    token = create_access_token({"sub": user["user_id"]})
+    
+    return {
+        "success": True,
+        "message": "Login successful",
+        "data": {
+            "user_id": user["user_id"],
+            "username": user["username"],
+            "email": user["email"],
+            "role": user["role"],
+            "token": token
         }
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"❌ Login error: {str(e)}", exc_info=True)
-        raise HTTPException(
-            status_code=500,
-            detail=f"Login failed: {str(e)}"
-        )
+    }
+
+@app.post("/api/auth/refresh")
+async def refresh_token(user_id: str = Depends(current_user)):
+    """Exchange a still-valid token for a fresh one"""
+    require_token_issuer()
+    
+    if user_id not in users_db:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    return {
+        "success": True,
+        "message": "Token refreshed",
+        "data": {
+            "token": create_access_token({"sub": user_id})
+        }
+    }
 
 # ============= Video Endpoints =============
 
@@ -300,137 +638,244 @@ async def upload_video(
     file: UploadFile = File(...),
     title: str = None,
     description: str = None,
-    user_id: str = Depends(verify_token)
+    user_id: str = Depends(current_user)
 ):
     """Upload video file"""
-    try:
-        logger.info(f"📤 Video upload started - User: {user_id}, File: {file.filename}")
-        
-        # Validate file type
-        if not file.content_type or not file.content_type.startswith('video/'):
-            raise HTTPException(status_code=400, detail="File must be a video")
-        
-        if not title:
-            title = file.filename
-        
-        # Generate unique video ID
-        video_id = str(uuid.uuid4())
-        
-        # Save file
-        file_extension = os.path.splitext(file.filename)[1]
-        file_path = UPLOAD_DIR / f"{video_id}{file_extension}"
-        
-        content = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(content)
-        
-        logger.info(f"✅ Video saved: {file_path} ({len(content)} bytes)")
-        
-        # Create video record
-        videos_db[video_id] = {
-            "video_id": video_id,
-            "user_id": user_id,
-            "title": title,
-            "description": description or "",
-            "file_path": str(file_path),
-            "status": VideoStatus.PROCESSING.value,
-            "progress": 0,
-            "uploaded_at": datetime.utcnow().isoformat(),
-            "file_size": len(content)
-        }
-        
-        # Start processing in background
-        asyncio.create_task(process_video(video_id))
-        
+    logger.info("📤 Video upload started - User: %s, File: %s", user_id, file.filename)
+    
+    # Validate file type
+    if file.content_type not in ALLOWED_VIDEO_TYPES:
+        raise HTTPException(status_code=415, detail="Unsupported media type")
+    
+    # Don't trust the client's content type; sniff the container signature
+    if not looks_like_video(await file.read(12)):
+        raise HTTPException(status_code=415, detail="Unsupported media type")
+    await file.seek(0)
+    
+    if not title:
+        title = file.filename
+    
+    # Shed load before spending disk I/O on a video the pipeline can't take
+    if transcribe_q.full():
+        raise HTTPException(status_code=503, detail="Processing queue is full, try again later")
+    
+    # Generate unique video ID
+    video_id = generate_id()
+    
+    # Save file
+    file_extension = os.path.splitext(file.filename)[1]
+    file_path = UPLOAD_DIR / f"{video_id}{file_extension}"
+    
+    # Stream to disk in chunks so memory stays flat regardless of video size, hashing
+    # as we go; SHA-256 runs at GB/s and is hidden behind the disk write
+    file_size = 0
+    content_hash = hashlib.sha256()
+    async with aiofiles.open(file_path, "wb") as f:
+        # Large, strictly sequential file: let the kernel batch writeback and read-ahead
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > MAX_UPLOAD_BYTES:
+                break
+            content_hash.update(chunk)
+            await f.write(chunk)
+    
+    # Backstop for the middleware, which counts the whole body rather than this file
+    if file_size > MAX_UPLOAD_BYTES:
+        await aiofiles.os.remove(file_path)
+        raise HTTPException(status_code=413, detail="File too large")
+    
+    logger.info("✅ Video saved: %s (%s bytes)", file_path, file_size)
+    
+    # Re-uploading the same file returns the existing video instead of processing it again
+    content_key = (user_id, content_hash.digest())
+    existing = videos_db.get(content_index.get(content_key))
+    if existing and existing["status"] != STATUS_FAILED:
+        await aiofiles.os.remove(file_path)
+        logger.info("♻️ Duplicate upload of %s", existing["video_id"])
         return {
             "success": True,
-            "message": "Video uploaded successfully",
+            "message": "Video already uploaded",
             "data": {
-                "video_id": video_id,
-                "status": VideoStatus.PROCESSING.value,
-                "title": title
+                "video_id": existing["video_id"],
+                "status": existing["status"],
+                "title": existing["title"]
             }
         }
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"❌ Upload error: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+    
+    # Create video record
+    videos_db[video_id] = {
+        "video_id": video_id,
+        "user_id": user_id,
+        "title": title,
+        "description": description or "",
+        "file_path": str(file_path),
+        "status": STATUS_PROCESSING,
+        "progress": 0,
+        "uploaded_at": datetime.now(timezone.utc),
+        "file_size": file_size,
+        "content_hash": content_hash.hexdigest()
+    }
+    videos_by_user[user_id].append(video_id)
+    content_index[content_key] = video_id
+    
+    # Start processing in background; never wait on the queue inside a request
+    try:
+        process_video(video_id)
+    except asyncio.QueueFull:
+        del videos_db[video_id]
+        videos_by_user[user_id].remove(video_id)
+        del content_index[content_key]
+        await aiofiles.os.remove(file_path)
+        raise HTTPException(status_code=503, detail="Processing queue is full, try again later")
+    
+    return {
+        "success": True,
+        "message": "Video uploaded successfully",
+        "data": {
+            "video_id": video_id,
+            "status": STATUS_PROCESSING,
+            "title": title
+        }
+    }
 
 @app.get("/api/videos/{video_id}/status")
-async def get_video_status(video_id: str, user_id: str = Depends(verify_token)):
+async def get_video_status(video_id: str, user_id: str = Depends(current_user)):
     """Get video processing status"""
+    if video_id not in videos_db:
+        raise HTTPException(status_code=404, detail="Video not found")
+    
+    video = videos_db[video_id]
+    
+    return {
+        "success": True,
+        "data": {
+            "video_id": video_id,
+            "status": video["status"],
+            "progress": video["progress"],
+            "title": video["title"]
+        }
+    }
+
+@app.post("/api/videos/{video_id}/retry")
+async def retry_video(video_id: str, user_id: str = Depends(current_user)):
+    """Re-queue a failed video; stages whose artifacts already exist are skipped"""
+    video = videos_db.get(video_id)
+    if not video:
+        raise HTTPException(status_code=404, detail="Video not found")
+    
+    if video["user_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    
+    if video["status"] != STATUS_FAILED:
+        raise HTTPException(status_code=409, detail="Only failed videos can be retried")
+    
     try:
-        if video_id not in videos_db:
-            raise HTTPException(status_code=404, detail="Video not found")
-        
-        video = videos_db[video_id]
-        
-        return {
-            "success": True,
-            "data": {
-                "video_id": video_id,
-                "status": video["status"],
-                "progress": video["progress"],
-                "title": video["title"]
-            }
+        process_video(video_id)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Processing queue is full, try again later")
+    video["status"] = STATUS_PROCESSING
+    video["progress"] = 0
+    
+    return {
+        "success": True,
+        "message": "Video queued for reprocessing",
+        "data": {
+            "video_id": video_id,
+            "status": STATUS_PROCESSING
         }
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Status check error: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to get video status")
+    }
 
 @app.get("/api/videos/{video_id}/transcript")
-async def get_transcript(video_id: str, user_id: str = Depends(verify_token)):
+async def get_transcript(video_id: str, request: Request, response: Response,
+                         user_id: str = Depends(current_user)):
     """Get video transcript"""
     if video_id not in transcripts_db:
         raise HTTPException(status_code=404, detail="Transcript not available yet")
     
-    return {"success": True, "data": transcripts_db[video_id]}
+    etag = etags_db.get(("transcript", video_id))
+    return conditional_response(request, response, etag, transcripts_db[video_id])
 
 @app.get("/api/videos/{video_id}/summary")
-async def get_summary(video_id: str, user_id: str = Depends(verify_token)):
+async def get_summary(video_id: str, request: Request, response: Response,
+                      user_id: str = Depends(current_user)):
     """Get video summary"""
     if video_id not in summaries_db:
         raise HTTPException(status_code=404, detail="Summary not available yet")
     
-    return {"success": True, "data": summaries_db[video_id]}
+    etag = etags_db.get(("summary", video_id))
+    return conditional_response(request, response, etag, summaries_db[video_id])
 
 @app.get("/api/videos/{video_id}/clips")
-async def get_clips(video_id: str, user_id: str = Depends(verify_token)):
+async def get_clips(video_id: str, request: Request, response: Response,
+                    user_id: str = Depends(current_user)):
     """Get generated clips"""
-    clips = [clip for clip in clips_db.values() if clip["video_id"] == video_id]
-    return {"success": True, "data": {"video_id": video_id, "clips": clips, "count": len(clips)}}
+    clips = [clips_db[clip_id] for clip_id in clips_by_video.get(video_id, ())]
+    etag = etags_db.get(("clips", video_id))
+    return conditional_response(request, response, etag, {"video_id": video_id, "clips": clips, "count": len(clips)})
+
+@app.get("/api/videos/{video_id}/download")
+async def download_video(video_id: str, user_id: str = Depends(current_user)):
+    """Download the original video file"""
+    video = videos_db.get(video_id)
+    if not video:
+        raise HTTPException(status_code=404, detail="Video not found")
+    
+    if video["user_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    
+    file_path = Path(video["file_path"])
+    return file_download(file_path, file_path.name)
+
+@app.get("/api/videos/{video_id}/clips/{clip_id}/download")
+async def download_clip(video_id: str, clip_id: str, user_id: str = Depends(current_user)):
+    """Download a generated clip"""
+    video = videos_db.get(video_id)
+    if not video or clip_id not in clips_by_video.get(video_id, ()):
+        raise HTTPException(status_code=404, detail="Clip not found")
+    
+    if video["user_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    
+    file_path = Path(clips_db[clip_id]["file_path"])
+    return file_download(file_path, file_path.name)
 
 @app.get("/api/videos")
-async def list_videos(user_id: str = Depends(verify_token)):
+async def list_videos(user_id: str = Depends(current_user)):
     """List user's videos"""
-    user_videos = [v for v in videos_db.values() if v["user_id"] == user_id]
+    # content_hash is internal (dedup and artifact keys), so it stays out of the payload
+    user_videos = [
+        {k: v for k, v in videos_db[vid].items() if k != "content_hash"}
+        for vid in videos_by_user.get(user_id, ())
+    ]
     return {"success": True, "data": {"videos": user_videos, "count": len(user_videos)}}
 
 # ============= Analytics Endpoints =============
 
 @app.get("/api/analytics/user/{target_user_id}")
-async def get_user_analytics(target_user_id: str, user_id: str = Depends(verify_token)):
+async def get_user_analytics(target_user_id: str, user_id: str = Depends(current_user)):
     """Get user analytics"""
-    if user_id != target_user_id and users_db.get(user_id, {}).get("role") != "admin":
+    if user_id != target_user_id and users_db.get(user_id, {}).get("role") != ROLE_ADMIN:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    analytics = analytics_db.get(target_user_id, {
-        "user_id": target_user_id,
-        "total_videos_watched": 0,
-        "total_watch_time": 0,
-        "topics_covered": [],
-        "average_completion_rate": 0.0,
-        "recent_activity": []
-    })
+    # Served after the access check so the cache never bypasses authorization
+    analytics = _analytics_cache.get(target_user_id)
+    if analytics is None:
+        analytics = analytics_db.get(target_user_id, {
+            "user_id": target_user_id,
+            "total_videos_watched": 0,
+            "total_watch_time": 0,
+            "topics_covered": [],
+            "average_completion_rate": 0.0,
+            "recent_activity": []
+        })
+        _analytics_cache[target_user_id] = analytics
     
     return {"success": True, "data": analytics}
 
 @app.get("/api/analytics/video/{video_id}")
-async def get_video_analytics(video_id: str, user_id: str = Depends(verify_token)):
+async def get_video_analytics(video_id: str, user_id: str = Depends(current_user)):
     """Get video analytics"""
     if video_id not in videos_db:
         raise HTTPException(status_code=404, detail="Video not found")
@@ -447,61 +892,124 @@ async def get_video_analytics(video_id: str, user_id: str = Depends(verify_token
     }
 
 # ============= Background Processing =============
+# Stage functions are blocking and run on processing_pool; the sleeps stand in for
+# Whisper transcription, LLM analysis and ffmpeg clip encoding. Each receives the
+# video record and the pipeline job carrying earlier stages' outputs. Their results
+# are cached on disk and may be reused by a later upload, so they must not carry
+# per-video fields; publish_results stamps video_id and clip ids.
 
-async def process_video(video_id: str):
-    """Background video processing"""
-    try:
-        video = videos_db.get(video_id)
-        if not video:
-            return
-        
-        logger.info(f"🔄 Processing started: {video_id}")
-        
-        stages = [
-            ("transcribing", 30, "Transcribing audio..."),
-            ("analyzing", 60, "Analyzing content..."),
-            ("generating_clips", 80, "Generating clips..."),
-            ("complete", 100, "Processing complete!")
-        ]
-        
-        for stage, progress, message in stages:
-            await asyncio.sleep(2)
-            video["status"] = stage
+def transcribe_video(video: dict, job: dict) -> dict:
+    """Speech-to-text stage"""
+    time.sleep(2)
+    return {
+        "full_text": "Sample educational transcript...",
+        "segments": [],
+        "duration": 600.0,
+        "language": "en"
+    }
+
+def analyze_transcript(video: dict, job: dict) -> dict:
+    """Summarization stage"""
+    time.sleep(2)
+    return {
+        "executive_summary": "Educational content summary...",
+        "key_concepts": [],
+        "learning_objectives": [],
+        "topics": [],
+        "difficulty_level": "intermediate"
+    }
+
+def generate_clips(video: dict, job: dict) -> List[dict]:
+    """Highlight clip generation stage"""
+    time.sleep(2)
+    return []
+
+def run_stage(stage_fn, key: str, directory: Path, video: dict, job: dict):
+    """Run a pipeline stage, or load its output if an earlier attempt already produced it"""
+    # Artifacts are named by a hash chained from the previous stage's, so changing
+    # upstream inputs or PIPELINE_VERSION invalidates everything downstream
+    digest = hashlib.sha256(f"{PIPELINE_VERSION}:{key}:{job['input_digest']}".encode()).hexdigest()
+    path = directory / f"{digest}.json"
+    job["input_digest"] = digest
+    
+    if path.exists():
+        logger.info("⏭️ %s: reusing %s from %s", video['video_id'], key, path.name)
+        return orjson.loads(path.read_bytes())
+    
+    result = stage_fn(video, job)
+    # Write-then-rename so a crash mid-write never leaves a file that satisfies the check
+    tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(orjson.dumps(result))
+    os.replace(tmp_path, path)
+    return result
+
+def publish_results(video: dict, job: dict):
+    """Store pipeline outputs, then mark the video complete"""
+    video_id = video["video_id"]
+    transcript = {"video_id": video_id, **job["transcript"]}
+    summary = {"video_id": video_id, **job["summary"]}
+    clips = [{"clip_id": generate_id(), "video_id": video_id, **clip} for clip in job["clips"]]
+    transcripts_db[video_id] = transcript
+    summaries_db[video_id] = summary
+    for clip in clips:
+        clips_db[clip["clip_id"]] = clip
+        clips_by_video[video_id].append(clip["clip_id"])
+    
+    # Results are immutable from here on, so their ETags can be computed once
+    etags_db[("transcript", video_id)] = compute_etag(transcript)
+    etags_db[("summary", video_id)] = compute_etag(summary)
+    etags_db[("clips", video_id)] = compute_etag(clips)
+
+    # Results go in before the status flips so clients never see a 404
+    video["status"] = STATUS_COMPLETE
+    video["progress"] = 100
+    logger.info("✅ Processing complete: %s", video_id)
+
+async def stage_worker(inbox: asyncio.Queue, outbox: Optional[asyncio.Queue], key: str, stage_fn,
+                       directory: Path, stage_status: VideoStatus, progress: int, message: str):
+    """Consume jobs from inbox, run one pipeline stage, hand the job to outbox"""
+    loop = asyncio.get_running_loop()
+    while True:
+        job = await inbox.get()
+        video_id = job["video_id"]
+        try:
+            video = videos_db.get(video_id)
+            if not video:
+                continue
+
+            video["status"] = stage_status.value
             video["progress"] = progress
-            logger.info(f"📊 {video_id}: {message} ({progress}%)")
-        
-        # Create dummy data
-        transcripts_db[video_id] = {
-            "video_id": video_id,
-            "full_text": "Sample educational transcript...",
-            "segments": [],
-            "duration": 600.0,
-            "language": "en"
-        }
-        
-        summaries_db[video_id] = {
-            "video_id": video_id,
-            "executive_summary": "Educational content summary...",
-            "key_concepts": [],
-            "learning_objectives": [],
-            "topics": [],
-            "difficulty_level": "intermediate"
-        }
-        
-        logger.info(f"✅ Processing complete: {video_id}")
-        
-    except Exception as e:
-        logger.error(f"❌ Processing error {video_id}: {str(e)}")
-        if video_id in videos_db:
-            videos_db[video_id]["status"] = "failed"
+            logger.info("📊 %s: %s (%s%%)", video_id, message, progress)
+            job[key] = await loop.run_in_executor(
+                processing_pool, run_stage, stage_fn, key, directory, video, job
+            )
+
+            if outbox is not None:
+                await outbox.put(job)
+            else:
+                publish_results(video, job)
+        except Exception as e:
+            logger.error("❌ Processing error %s: %s", video_id, e)
+            if video_id in videos_db:
+                videos_db[video_id]["status"] = STATUS_FAILED
+        finally:
+            inbox.task_done()
+
+def process_video(video_id: str):
+    """Queue a video for background processing; raises asyncio.QueueFull when saturated"""
+    video = videos_db[video_id]
+    # Seeding the stage hash chain with the owner and the file's content hash lets a
+    # re-upload or retry reuse artifacts, without sharing them across accounts
+    transcribe_q.put_nowait({"video_id": video_id, "input_digest": f"{video['user_id']}:{video['content_hash']}"})
+    logger.info("🔄 Processing queued: %s", video_id)
 
 # ============= Error Handlers =============
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
     """Handle HTTP exceptions"""
-    logger.warning(f"HTTP {exc.status_code}: {exc.detail}")
-    return JSONResponse(
+    logger.warning("HTTP %s: %s", exc.status_code, exc.detail)
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "success": False,
@@ -510,18 +1018,28 @@ async def http_exception_handler(request, exc):
         }
     )
 
-@app.exception_handler(Exception)
-async def global_exception_handler(request, exc):
-    """Handle all other exceptions"""
-    logger.error(f"❌ Unhandled error: {str(exc)}", exc_info=True)
-    return JSONResponse(
-        status_code=500,
-        content={
-            "success": False,
-            "message": "Internal server error",
-            "error": str(exc)
-        }
-    )
+# Unhandled exceptions are answered by ErrorResponseMiddleware
+
+# ============= OpenAPI =============
+
+_default_openapi = app.openapi
+
+def openapi_with_bearer():
+    """OpenAPI schema declaring bearer auth on routes that depend on current_user"""
+    # AuthMiddleware parses the header, so no route carries HTTPBearer for the docs to find
+    if app.openapi_schema:
+        return app.openapi_schema
+    schema = _default_openapi()
+    schema.setdefault("components", {})["securitySchemes"] = {
+        "HTTPBearer": {"type": "http", "scheme": "bearer"}
+    }
+    for route in app.routes:
+        if isinstance(route, APIRoute) and any(dep.call is current_user for dep in route.dependant.dependencies):
+            for method in route.methods:
+                schema["paths"][route.path_format][method.lower()]["security"] = [{"HTTPBearer": []}]
+    return schema
+
+app.openapi = openapi_with_bearer
 
 # ============= Startup Event =============
 
@@ -530,14 +1048,71 @@ async def startup_event():
     """Log startup information"""
     logger.info("=" * 60)
     logger.info("🚀 EduClip AI Backend Starting...")
-    logger.info(f"📍 Environment: {os.getenv('RENDER', 'local')}")
-    logger.info(f"📁 Storage: {BASE_DIR}")
-    logger.info(f"🔒 CORS: Enabled (all origins)")
-    logger.info(f"📚 Docs: /docs")
+    logger.info("📍 Environment: %s", os.getenv('RENDER', 'local'))
+    logger.info("📁 Storage: %s", BASE_DIR)
+    logger.info("🔒 CORS: %s (regex: %s)", ', '.join(ALLOWED_ORIGINS) or '-', ALLOWED_ORIGIN_REGEX or '-')
+    logger.info("📚 Docs: /docs")
     logger.info("=" * 60)
+    
+    # PyJWT signs HS256 with hmac + hashlib.sha256, which only takes the
+    # OpenSSL (SHA-NI accelerated) path when hashlib is built against OpenSSL
+    if hashlib.sha256.__module__ != "_hashlib":
+        logger.warning("⚠️ hashlib is not OpenSSL-backed; JWT signing will use the slow builtin SHA-256")
+    
+    if ALGORITHM == "HS256":
+        if not os.getenv("SECRET_KEY"):
+            logger.warning("⚠️ SECRET_KEY not set; issued tokens will stop working on restart")
+    elif not JWT_PRIVATE_KEY:
+        logger.warning("⚠️ JWT_PUBLIC_KEY only: verifying tokens, register/login/refresh are disabled")
+    elif not JWT_PUBLIC_KEY:
+        logger.info("🔑 JWT_PUBLIC_KEY not set; verifying with the public half of JWT_PRIVATE_KEY")
+    
+    # All state lives in this process, so extra workers would each see a different database
+    if max(int(os.getenv("WEB_CONCURRENCY", "1")), int(os.getenv("WORKERS", "1"))) > 1:
+        logger.warning("⚠️ More than one worker: users and videos are per-process; run a single worker")
+
+@app.on_event("startup")
+async def start_pipeline():
+    """Create the processing queues and pool, and launch the stage workers"""
+    global transcribe_q, analyze_q, clip_q, processing_pool
+    processing_pool = ThreadPoolExecutor(max_workers=PROCESSING_WORKERS * 3, thread_name_prefix="processing")
+    transcribe_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    analyze_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    clip_q = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+    stages = [
+        (transcribe_q, analyze_q, "transcript", transcribe_video, TRANSCRIPTS_DIR, VideoStatus.TRANSCRIBING, 30, "Transcribing audio..."),
+        (analyze_q, clip_q, "summary", analyze_transcript, SUMMARIES_DIR, VideoStatus.ANALYZING, 60, "Analyzing content..."),
+        (clip_q, None, "clips", generate_clips, CLIP_PLANS_DIR, VideoStatus.GENERATING_CLIPS, 80, "Generating clips..."),
+    ]
+    for stage in stages:
+        for _ in range(PROCESSING_WORKERS):
+            pipeline_tasks.append(asyncio.create_task(stage_worker(*stage)))
+
+@app.on_event("startup")
+async def start_hash_pool():
+    """Create the bcrypt thread pool"""
+    global hash_pool
+    hash_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="bcrypt")
+
+@app.on_event("shutdown")
+async def stop_pipeline():
+    """Cancel stage workers and release the worker pools"""
+    for task in pipeline_tasks:
+        task.cancel()
+    pipeline_tasks.clear()
+    processing_pool.shutdown(wait=False, cancel_futures=True)
+    hash_pool.shutdown(wait=False, cancel_futures=True)
 
 # For local development
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 10000))
-    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
+    # WORKERS defaults to 1 because all state is in process memory. "auto" picks
+    # uvloop/httptools when installed; uvicorn[standard] skips uvloop on Windows
+    uvicorn.run(
+        "main:app", host="0.0.0.0", port=port,
+        workers=int(os.getenv("WORKERS", "1")),
+        loop="auto", http="auto",
+        log_level="info", access_log=False
+    )